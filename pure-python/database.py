@@ -1,13 +1,29 @@
 from __future__ import annotations
 
 from collections import defaultdict
+import contextlib
 import dataclasses
 import enum
-import json
+import functools
+import importlib.util  # noqa: F401, required by Kuzu to scan Python objects in COPY FROM
 import os
-import shutil
+import re
+import sys
+from typing import Iterable
 
 import kuzu
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+# Batches smaller than this are written with a single parameterized query,
+# which is cheaper than staging them for a COPY FROM.
+COPY_MIN_ROWS = 2048
+
+# The Arrow type of the `short_names` column.
+_SHORT_NAMES_TYPE = pa.list_(pa.string())
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "graph", "schema.cypher")
 
 
 class NodeType(str, enum.Enum):
@@ -26,87 +42,128 @@ class EdgeType(str, enum.Enum):
     REFERENCES = "references"
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True, frozen=True)
 class Point:
     line: int
     column: int
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True, frozen=True)
 class Node:
     type: NodeType
     name: str
-    code: str = ""
-    start: Point | None = None
-    end: Point | None = None
+    # Nodes are identified by (type, name) only.
+    code: str = dataclasses.field(default="", compare=False)
+    start: Point | None = dataclasses.field(default=None, compare=False)
+    end: Point | None = dataclasses.field(default=None, compare=False)
+    _short_names: list[str] | None = dataclasses.field(
+        default=None, init=False, repr=False, compare=False
+    )
 
     @classmethod
     def from_dict(cls, data: dict) -> Node:
         return Node(
             type=NodeType(data["type"]),
-            name=data["name"],
+            # The same nodes are fetched over and over (e.g. imported ones), share their names.
+            name=sys.intern(data["name"]),
             code=data.get("code", ""),
             start=Point(line=data.get("start_line", 0), column=0),  # no column info
             end=Point(line=data.get("end_line", 0), column=0),  # no column info
         )
 
-    def __hash__(self):
-        return hash((self.type, self.name))
-
-    def __eq__(self, other: None):
-        return self.type == other.type and self.name == other.name
-
     @property
     def short_names(self) -> list[str]:
-        def make_names(name: str) -> list[str]:
-            lower = name.lower()
-            if lower != name:
-                return [name, lower]
-            return [name]
-
-        if ":" not in self.name:
-            # "src/a.py" => a
-            file_name = self.name.rsplit("/", 1)[-1]
-            return make_names(file_name)
-
-        # "src/a.py:A" => A, a
-        attr_name = self.name.rsplit(":", 1)[-1]
-        if "." not in attr_name:
-            return make_names(attr_name)
-
-        # "src/a.py:A.meth" => meth
-        sub_attr_name = attr_name.rsplit(".", 1)[-1]
-        return make_names(sub_attr_name)
+        # Computed once per node and cached in the `_short_names` slot.
+        if self._short_names is None:
+            object.__setattr__(self, "_short_names", self._make_short_names())
+        return self._short_names
+
+    def _make_short_names(self) -> list[str]:
+        name = self.name
+        i = name.rfind(":")
+        if i < 0:
+            # "src/a.py" => a.py
+            short_name = name[name.rfind("/") + 1 :]
+        else:
+            # "src/a.py:A" => A, a
+            # "src/a.py:A.meth" => meth
+            short_name = name[max(i, name.rfind(".")) + 1 :]
+
+        lower = short_name.lower()
+        if lower != short_name:
+            return [short_name, lower]
+        return [short_name]
+
+    @classmethod
+    def batch_short_names(cls, names: list[str]) -> pa.ListArray:
+        """Compute `short_names` for many node names at once with Arrow compute kernels."""
+        names = pa.array(names, type=pa.string())
+        short_names = pc.if_else(
+            pc.match_substring(names, ":"),
+            # "src/a.py:A" => A, "src/a.py:A.meth" => meth
+            pc.replace_substring_regex(names, r"^.*[:.]", ""),
+            # "src/a.py" => a.py
+            pc.replace_substring_regex(names, r"^.*/", ""),
+        )
+        # Lowercase with str.lower like `short_names` does, since utf8_lower differs
+        # for some letters (e.g. final sigma in "ΟΔΟΣ", or "İ").
+        lower = pa.array(
+            [name.lower() for name in short_names.to_pylist()], type=pa.string()
+        )
+        # Names never contain NUL, so use it to pair each name with its lowercase.
+        joined = pc.if_else(
+            pc.equal(short_names, lower),
+            short_names,
+            pc.binary_join_element_wise(short_names, lower, "\x00"),
+        )
+        return pc.split_pattern(joined, "\x00")
 
     def to_dict(self) -> dict:
-        match self.type:
-            case NodeType.UNPARSED | NodeType.DIRECTORY:
-                return {
-                    "name": self.name,
-                    "type": self.type.value,
-                    "short_names": self.short_names,
-                }
-            case NodeType.FILE:
-                return {
-                    "name": self.name,
-                    "type": self.type.value,
-                    "short_names": self.short_names,
-                    "code": self.code,
-                }
-            case NodeType.CLASS | NodeType.FUNCTION | NodeType.VARIABLE:
-                return {
-                    "name": self.name,
-                    "type": self.type.value,
-                    "short_names": self.short_names,
-                    "code": self.code,
-                    "start_line": self.start.line,
-                    "end_line": self.end.line,
-                }
-            case _:
-                raise ValueError(f"Unsupport node type: {self.type}")
-
-
-@dataclasses.dataclass
+        to_dict = _NODE_TO_DICT.get(self.type)
+        if not to_dict:
+            raise ValueError(f"Unsupport node type: {self.type}")
+        return to_dict(self)
+
+
+def _basic_node_to_dict(node: Node) -> dict:
+    return {
+        "name": node.name,
+        "type": node.type.value,
+        "short_names": node.short_names,
+    }
+
+
+def _file_node_to_dict(node: Node) -> dict:
+    return {
+        "name": node.name,
+        "type": node.type.value,
+        "short_names": node.short_names,
+        "code": node.code,
+    }
+
+
+def _code_node_to_dict(node: Node) -> dict:
+    return {
+        "name": node.name,
+        "type": node.type.value,
+        "short_names": node.short_names,
+        "code": node.code,
+        "start_line": node.start.line,
+        "end_line": node.end.line,
+    }
+
+
+_NODE_TO_DICT = {
+    NodeType.UNPARSED: _basic_node_to_dict,
+    NodeType.DIRECTORY: _basic_node_to_dict,
+    NodeType.FILE: _file_node_to_dict,
+    NodeType.CLASS: _code_node_to_dict,
+    NodeType.FUNCTION: _code_node_to_dict,
+    NodeType.VARIABLE: _code_node_to_dict,
+}
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
 class Relationship:
     type: EdgeType
     from_: Node
@@ -126,92 +183,365 @@ class Relationship:
         )
 
     def to_dict(self) -> dict:
-        match self.type:
-            case EdgeType.CONTAINS | EdgeType.INHERITS | EdgeType.REFERENCES:
-                return {
-                    "from": self.from_.name,
-                    "to": self.to_.name,
-                    "type": self.from_to,
-                }
-            case EdgeType.IMPORTS:
-                return {
-                    "from": self.from_.name,
-                    "to": self.to_.name,
-                    "type": self.from_to,
-                    "import": self.import_,
-                    "alias": self.alias,
-                }
-            case _:
-                raise ValueError(f"Unsupport edge type: {self.type}")
+        to_dict = _RELATIONSHIP_TO_DICT.get(self.type)
+        if not to_dict:
+            raise ValueError(f"Unsupport edge type: {self.type}")
+        return to_dict(self)
 
     @property
     def from_to(self) -> str:
         return f"{self.from_.type.value}_{self.to_.type.value}"
 
 
+def _basic_relationship_to_dict(rel: Relationship) -> dict:
+    return {
+        "from": rel.from_.name,
+        "to": rel.to_.name,
+        "type": rel.from_to,
+    }
+
+
+def _imports_relationship_to_dict(rel: Relationship) -> dict:
+    return {
+        "from": rel.from_.name,
+        "to": rel.to_.name,
+        "type": rel.from_to,
+        "import": rel.import_,
+        "alias": rel.alias,
+    }
+
+
+_RELATIONSHIP_TO_DICT = {
+    EdgeType.CONTAINS: _basic_relationship_to_dict,
+    EdgeType.INHERITS: _basic_relationship_to_dict,
+    EdgeType.REFERENCES: _basic_relationship_to_dict,
+    EdgeType.IMPORTS: _imports_relationship_to_dict,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _schema_ddl() -> list[tuple[str, str]]:
+    """Return the (table name, CREATE statement) pairs defined in the schema file, in order."""
+    with open(SCHEMA_PATH, "r") as f:
+        text = "".join(line for line in f if not line.lstrip().startswith("//"))
+
+    ddl: list[tuple[str, str]] = []
+    for statement in text.split(";"):
+        statement = statement.strip()
+        if not statement:
+            continue
+        table_name = re.search(r"TABLE\s+(?:IF NOT EXISTS\s+)?(\w+)", statement).group(1)
+        ddl.append((table_name, statement + ";"))
+    return ddl
+
+
 class Database:
-    def __init__(self, db_path: str, tmp_data: str = "./tmp_data"):
-        db: kuzu.Database = kuzu.Database(db_path)
+    def __init__(self, db_path: str):
+        # Checkpoints are issued explicitly once per bulk load (see `_transaction`).
+        db: kuzu.Database = kuzu.Database(db_path, auto_checkpoint=False)
         self.conn: kuzu.Connection = kuzu.Connection(db)
-        self.tmp_data = tmp_data
-
-    def execute(self, query: str, parameters: dict | None = None) -> list:
-        result: list = []
+        self._prepared_statements: dict[str, kuzu.PreparedStatement] = {}
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Run the enclosed statements in a single transaction followed by one checkpoint."""
+        self.execute("BEGIN TRANSACTION;")
+        try:
+            yield
+        except BaseException:
+            # Kuzu rolls back on its own when a statement fails inside the transaction.
+            with contextlib.suppress(RuntimeError):
+                self.execute("ROLLBACK;")
+            raise
+        self.execute("COMMIT;")
+        self.execute("CHECKPOINT;")
+
+    def prepare(self, query: str) -> kuzu.PreparedStatement:
+        """Return a cached prepared statement for `query`, so that it is parsed and planned only once."""
+        statement = self._prepared_statements.get(query)
+        if statement is None:
+            statement = self.conn.prepare(query)
+            self._prepared_statements[query] = statement
+        return statement
+
+    def execute(
+        self, query: str | kuzu.PreparedStatement, parameters: dict | None = None
+    ) -> list:
         response = self.conn.execute(query, parameters=parameters)
-        while response.has_next():
-            result.append(response.get_next())
-        return result
+        get_next = response.get_next
+        return [get_next() for _ in range(response.get_num_tuples())]
+
+    def execute_as_arrow(
+        self, query: str | kuzu.PreparedStatement, parameters: dict | None = None
+    ) -> pa.Table:
+        """Like `execute`, but return the result as one columnar Arrow table instead of Python rows."""
+        return self.conn.execute(query, parameters=parameters).get_as_arrow()
 
     def upsert_node(self, node: Node) -> None:
         table_name = node.type.title()
-        data = "{" + ", ".join(f"{k}: {v!r}" for k, v in node.to_dict().items()) + "}"
-        self.execute(f"MERGE (n:{table_name} {data}) RETURN n.*;")
+        data = node.to_dict()
+        props = ", ".join(f"n.{k} = ${k}" for k in data if k != "name")
+        self.execute(
+            f"MERGE (n:{table_name} {{name: $name}}) SET {props} RETURN n.*;",
+            parameters=data,
+        )
+        self._write_short_names(
+            node.type, [node.name], pa.array([node.short_names], _SHORT_NAMES_TYPE)
+        )
 
-    def batch_add_nodes(self, *nodes: Node) -> None:
-        self.execute("Load json;")
+    def upsert_nodes(self, *nodes: Node) -> None:
         group_by_type = defaultdict(list)
         for n in nodes:
             group_by_type[n.type].append(n.to_dict())
 
-        for typ, data in group_by_type.items():
-            file_path = os.path.join(self.tmp_data, typ + ".json")
-            with open(file_path, "w+", encoding="utf-8") as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-            self.execute(f"COPY {typ.title()} FROM '{file_path}';")
+        for typ, rows in group_by_type.items():
+            self._merge_nodes(typ, rows)
+
+    def _merge_nodes(self, typ: NodeType, rows: list[dict]) -> None:
+        """Upsert the rows: nodes that already exist are updated rather than rejected."""
+        props = ", ".join(f"n.{k} = r.{k}" for k in rows[0] if k != "name")
+        self.execute(
+            f"""
+            UNWIND $rows AS r
+            MERGE (n:{typ.title()} {{name: r.name}})
+            SET {props};
+            """,
+            parameters={"rows": rows},
+        )
+        self._write_short_names(
+            typ,
+            [r["name"] for r in rows],
+            pa.array([r["short_names"] for r in rows], _SHORT_NAMES_TYPE),
+        )
+
+    def _create_nodes(self, typ: NodeType, rows: list[dict]) -> None:
+        """Insert the rows as new nodes.
+
+        Like COPY, this fails on a name that already exists or is duplicated in `rows`.
+        """
+        props = ", ".join(f"{k}: r.{k}" for k in rows[0])
+        self.execute(
+            f"""
+            UNWIND $rows AS r
+            CREATE (n:{typ.title()} {{{props}}});
+            """,
+            parameters={"rows": rows},
+        )
+        self._write_short_names(
+            typ,
+            [r["name"] for r in rows],
+            pa.array([r["short_names"] for r in rows], _SHORT_NAMES_TYPE),
+            new=True,
+        )
+
+    def batch_add_nodes(self, *nodes: Node) -> None:
+        group_by_type = defaultdict(list)
+        for n in nodes:
+            group_by_type[n.type].append(n)
+
+        with self._transaction():
+            self._write_nodes(group_by_type)
+
+    def _write_nodes(self, group_by_type: dict[NodeType, list[Node]]) -> None:
+        for typ, nodes in group_by_type.items():
+            if len(nodes) < COPY_MIN_ROWS:
+                self._create_nodes(typ, [n.to_dict() for n in nodes])
+                continue
+
+            # Build the columns directly rather than one dict per node.
+            names = [n.name for n in nodes]
+            columns = {
+                "name": names,
+                "type": [typ.value] * len(nodes),
+                "short_names": Node.batch_short_names(names),
+            }
+            if typ not in (NodeType.UNPARSED, NodeType.DIRECTORY):
+                columns["code"] = [n.code for n in nodes]
+            if typ in (NodeType.CLASS, NodeType.FUNCTION, NodeType.VARIABLE):
+                columns["start_line"] = [n.start.line for n in nodes]
+                columns["end_line"] = [n.end.line for n in nodes]
+
+            # Kuzu scans the Arrow table referenced by its variable name.
+            rows = pa.Table.from_pydict(columns)
+            self.execute(f"COPY {typ.title()} FROM rows;")
+            self._write_short_names(typ, names, columns["short_names"], new=True)
+
+    def _write_short_names(
+        self,
+        typ: NodeType,
+        names: list[str],
+        short_names: pa.ListArray,
+        new: bool = False,
+    ) -> None:
+        """Link the nodes with the given names to their short names in the ShortName table.
+
+        `short_names` holds the short names of each node. Pass `new` if the nodes have
+        just been created, so that they cannot be linked to any short name yet.
+        """
+        # One (short name, node name) pair per element of the lists.
+        flat_short_names = pc.list_flatten(short_names)
+        node_names = pc.take(
+            pa.array(names, type=pa.string()), pc.list_parent_indices(short_names)
+        )
+
+        unique_short_names = pc.unique(flat_short_names).to_pylist()
+        if not unique_short_names:
+            return
+
+        result = self.execute(
+            self.prepare(
+                """
+                UNWIND $short_names AS short_name
+                MATCH (s:ShortName {short_name: short_name})
+                RETURN s.short_name;
+                """
+            ),
+            parameters={"short_names": unique_short_names},
+        )
+        existing = {short_name for short_name, in result}
+        missing = [s for s in unique_short_names if s not in existing]
+        if len(missing) >= COPY_MIN_ROWS:
+            # Kuzu scans the Arrow table referenced by its variable name.
+            rows = pa.Table.from_pydict({"short_name": missing})
+            self.execute("COPY ShortName FROM rows;")
+        elif missing:
+            self.execute(
+                self.prepare(
+                    """
+                    UNWIND $short_names AS short_name
+                    CREATE (:ShortName {short_name: short_name});
+                    """
+                ),
+                parameters={"short_names": missing},
+            )
+
+        if new and len(node_names) >= COPY_MIN_ROWS:
+            # Kuzu scans the Arrow table referenced by its variable name.
+            rows = pa.Table.from_arrays(
+                [flat_short_names, node_names], names=["from", "to"]
+            )
+            self.execute(
+                f"COPY SHORT_NAME_OF FROM rows (from='ShortName', to='{typ.title()}');"
+            )
+            return
+
+        self.execute(
+            self.prepare(
+                f"""
+                UNWIND $rows AS r
+                MATCH (s:ShortName {{short_name: r.short_name}}), (n:{typ.title()} {{name: r.name}})
+                MERGE (s)-[:SHORT_NAME_OF]->(n);
+                """
+            ),
+            parameters={
+                "rows": [
+                    {"short_name": short_name, "name": name}
+                    for short_name, name in zip(
+                        flat_short_names.to_pylist(), node_names.to_pylist()
+                    )
+                ]
+            },
+        )
 
     def batch_add_relationships(self, *relationships: Relationship) -> None:
-        self.execute("Load json;")
-        group_by_type = defaultdict(lambda: defaultdict(list))
+        group_by_type = defaultdict(list)
         for r in relationships:
-            group_by_type[r.type][r.from_to].append(r.to_dict())
-
-        for typ, data in group_by_type.items():
-            for from_to, d in data.items():
-                table_name = typ.upper()
-                from_type, to_type = from_to.split("_")
-                filename = f"{table_name}_{from_to}.json"
-                file_path = os.path.join(self.tmp_data, filename)
-                with open(file_path, "w+", encoding="utf-8") as f:
-                    json.dump(d, f, indent=2, ensure_ascii=False)
-                self.execute(
-                    f"COPY {table_name} FROM '{file_path}' (from='{from_type.title()}', to='{to_type.title()}');"
+            group_by_type[(r.type, r.from_.type, r.to_.type)].append(r)
+
+        with self._transaction():
+            self._write_relationships(group_by_type)
+
+    def _write_relationships(
+        self,
+        group_by_type: dict[tuple[EdgeType, NodeType, NodeType], list[Relationship]],
+    ) -> None:
+        for (typ, from_type, to_type), rels in group_by_type.items():
+            # Build the columns directly rather than one dict per relationship.
+            columns = {
+                "from": [r.from_.name for r in rels],
+                "to": [r.to_.name for r in rels],
+                "type": [f"{from_type.value}_{to_type.value}"] * len(rels),
+            }
+            if typ == EdgeType.IMPORTS:
+                columns["import"] = [r.import_ for r in rels]
+                columns["alias"] = [r.alias for r in rels]
+
+            if len(rels) < COPY_MIN_ROWS:
+                props = ", ".join(
+                    f"{k}: r.{k}" for k in columns if k not in ("from", "to")
                 )
+                result = self.execute(
+                    f"""
+                    UNWIND $rows AS r
+                    MATCH (a:{from_type.title()} {{name: r.from}}), (b:{to_type.title()} {{name: r.to}})
+                    CREATE (a)-[:{typ.upper()} {{{props}}}]->(b)
+                    RETURN count(*);
+                    """,
+                    parameters={
+                        "rows": [
+                            dict(zip(columns, values))
+                            for values in zip(*columns.values())
+                        ]
+                    },
+                )
+                # MATCH silently skips the rows whose endpoints do not exist,
+                # whereas COPY rejects them, so fail the same way here.
+                if result[0][0] != len(rels):
+                    missing = set(columns["from"]) - self._existing_names(
+                        from_type, columns["from"]
+                    )
+                    missing |= set(columns["to"]) - self._existing_names(
+                        to_type, columns["to"]
+                    )
+                    raise RuntimeError(
+                        f"Cannot create {typ.upper()} relationships from {from_type.title()} "
+                        f"to {to_type.title()}, missing nodes: {sorted(missing)[:10]}"
+                    )
+                continue
+
+            # Kuzu scans the Arrow table referenced by its variable name.
+            rows = pa.Table.from_pydict(columns)
+            self.execute(
+                f"COPY {typ.upper()} FROM rows (from='{from_type.title()}', to='{to_type.title()}');"
+            )
 
-    def delete_all(self):
-        # Delete all records
-        self.execute("MATCH (n) DETACH DELETE n;")
-        if self.tmp_data:
-            if os.path.exists(self.tmp_data):
-                shutil.rmtree(self.tmp_data)
-            os.makedirs(self.tmp_data, exist_ok=True)
+    def _existing_names(self, typ: NodeType, names: list[str]) -> set[str]:
+        """Return those of the given names that exist in the node table of `typ`."""
+        result = self.execute(
+            f"""
+            UNWIND $names AS name
+            MATCH (a:{typ.title()} {{name: name}})
+            RETURN a.name;
+            """,
+            parameters={"names": names},
+        )
+        return {name for name, in result}
+
+    def delete_all(self, fast: bool = True):
+        if not fast:
+            # Delete all records, keeping the tables as they are.
+            self.execute("MATCH (n) DETACH DELETE n;")
+            return
+
+        # Dropping and recreating the tables avoids visiting every record.
+        ddl = _schema_ddl()
+        # Relationship tables are defined last and must be dropped first.
+        for table_name, _ in reversed(ddl):
+            self.execute(f"DROP TABLE IF EXISTS {table_name};")
+        for _, statement in ddl:
+            self.execute(statement)
+        # Statements prepared against the dropped tables are no longer valid.
+        self._prepared_statements.clear()
 
     def get_node(self, name: str) -> Node | None:
         result = self.execute(
-            """
-            MATCH (a)
-            WHERE a.name = $name
-            RETURN a;
-            """,
+            self.prepare(
+                """
+                MATCH (a)
+                WHERE a.name = $name
+                RETURN a;
+                """
+            ),
             parameters={"name": name},
         )
         if not result:
@@ -220,16 +550,56 @@ class Database:
         data = result[0][0]
         return Node.from_dict(data)
 
-    def has_node(self, name: str) -> bool:
+    def batch_get_nodes(self, names: Iterable[str]) -> dict[str, Node]:
+        """Fetch the nodes with the given names in one query, keyed by name."""
+        names = list(names)
+        if not names:
+            return {}
+
         result = self.execute(
-            """
-            MATCH (a)
-            WHERE a.name = $name
-            RETURN a;
-            """,
+            self.prepare(
+                """
+                UNWIND $names AS name
+                MATCH (a {name: name})
+                RETURN a;
+                """
+            ),
+            parameters={"names": names},
+        )
+        return {data["name"]: Node.from_dict(data) for data, in result}
+
+    def has_node(self, name: str) -> bool:
+        # Only existence matters, so avoid fetching the node (and its code) at all.
+        response = self.conn.execute(
+            self.prepare(
+                """
+                MATCH (a)
+                WHERE a.name = $name
+                RETURN 1
+                LIMIT 1;
+                """
+            ),
             parameters={"name": name},
         )
-        return bool(result)
+        return response.has_next()
+
+    def batch_has_nodes(self, names: Iterable[str]) -> set[str]:
+        """Return those of the given names that exist, checked in one query."""
+        names = list(names)
+        if not names:
+            return set()
+
+        result = self.execute(
+            self.prepare(
+                """
+                UNWIND $names AS name
+                MATCH (a {name: name})
+                RETURN a.name;
+                """
+            ),
+            parameters={"names": names},
+        )
+        return {name for name, in result}
 
     def traverse_nodes(
         self,
@@ -245,9 +615,10 @@ class Database:
         )  # Limit depth to 5 for performance reasons.
         level = f"*1..{depth}"
 
-        rel_labels = ""
-        if relationship_type_filter:
-            rel_labels = "|".join(f":{dep.upper()}" for dep in relationship_type_filter)
+        # Always name the labels, so as not to follow the links to the short names.
+        rel_labels = "|".join(
+            f":{dep.upper()}" for dep in relationship_type_filter or EdgeType
+        )
         relationship = f"-[b{rel_labels}{level}]-"
 
         match direction:
@@ -264,8 +635,9 @@ class Database:
 
         result = self.execute(
             f"""
+            MATCH (a {{name: $start_node_name}})
+            WITH a
             MATCH (a){relationship}(c{target_nodes})
-            WHERE a.name = $start_node_name
             RETURN b, c
             LIMIT {limit};
             """,
@@ -45,6 +45,11 @@ CREATE NODE TABLE IF NOT EXISTS Variable (
     end_line UINT32,
     PRIMARY KEY(name)
 );
+// Index of the short names, since list columns (i.e. `short_names`) are not indexable
+CREATE NODE TABLE IF NOT EXISTS ShortName (
+    short_name STRING,
+    PRIMARY KEY(short_name)
+);
 
 // Create relationships
 CREATE REL TABLE IF NOT EXISTS CONTAINS (
@@ -86,3 +91,11 @@ CREATE REL TABLE IF NOT EXISTS REFERENCES (
     From Variable To Unparsed,
     type STRING
 );
+CREATE REL TABLE IF NOT EXISTS SHORT_NAME_OF (
+    From ShortName To Unparsed,
+    From ShortName To Directory,
+    From ShortName To File,
+    From ShortName To Class,
+    From ShortName To Function,
+    From ShortName To Variable
+);
@@ -1,8 +1,18 @@
 import argparse
-from collections import defaultdict, OrderedDict
+import bisect
+from collections import defaultdict
+import concurrent.futures
+import contextlib
 import dataclasses
 import fnmatch
+import functools
+import itertools
+import multiprocessing
 import os
+import pickle
+import re
+import sys
+from typing import Iterator
 
 import tree_sitter
 import tree_sitter_python
@@ -22,131 +32,344 @@ parser = tree_sitter.Parser(PY_LANGUAGE)
 with open("./references.scm", "r") as f:
     QUERY = PY_LANGUAGE.query(f.read())
 
+# 语法节点类型的 kind id，比较整数比比较类型字符串更快
+IMPORT_STATEMENT = PY_LANGUAGE.id_for_node_kind("import_statement", True)
+IMPORT_FROM_STATEMENT = PY_LANGUAGE.id_for_node_kind("import_from_statement", True)
+EXPRESSION_STATEMENT = PY_LANGUAGE.id_for_node_kind("expression_statement", True)
+FUNCTION_DEFINITION = PY_LANGUAGE.id_for_node_kind("function_definition", True)
+CLASS_DEFINITION = PY_LANGUAGE.id_for_node_kind("class_definition", True)
+DOTTED_NAME = PY_LANGUAGE.id_for_node_kind("dotted_name", True)
+ALIASED_IMPORT = PY_LANGUAGE.id_for_node_kind("aliased_import", True)
+WILDCARD_IMPORT = PY_LANGUAGE.id_for_node_kind("wildcard_import", True)
+
+# 字段 id，避免每次按字段名查找子节点
+FIELD_NAME = PY_LANGUAGE.field_id_for_name("name")
+FIELD_BODY = PY_LANGUAGE.field_id_for_name("body")
+FIELD_LEFT = PY_LANGUAGE.field_id_for_name("left")
+FIELD_ALIAS = PY_LANGUAGE.field_id_for_name("alias")
+FIELD_SUPERCLASSES = PY_LANGUAGE.field_id_for_name("superclasses")
+
+# 持久化已解析的标准库、三方库节点，供之后的运行复用
+LIB_CACHE_PATH = "./graph/lib_cache.pkl"
+
+# parse_path 每解析这么多个文件就把节点和关系写入一次数据库
+FLUSH_FILE_COUNT = 100
+
+# 文件数少于这个值时直接在当前进程中解析，省去启动工作进程的开销
+PARALLEL_MIN_FILES = 32
+# 每次分给工作进程的文件数
+PARSE_CHUNK_SIZE = 8
+
+# 参考.gitignore的忽略规则
+IGNORE_PATTERNS = [
+    # 默认忽略的目录
+    "__pycache__",
+    "tests",
+    "test",
+    "venv",
+    "env",
+    # 从.gitignore提取的规则
+    ".DS_Store",
+    "results/",
+    "*.py[cod]",
+    "*$py.class",
+    "*.so",
+    "build/",
+    "develop-eggs/",
+    "dist/",
+    "downloads/",
+    "eggs/",
+    ".eggs/",
+    "lib/",
+    "lib64/",
+    "parts/",
+    "sdist/",
+    "var/",
+    "wheels/",
+    "pip-wheel-metadata/",
+    "share/python-wheels/",
+    "*.egg-info/",
+    "*.egg",
+    "htmlcov/",
+    ".tox/",
+    ".nox/",
+    ".coverage",
+    ".coverage.*",
+    ".cache",
+    ".hypothesis/",
+    ".pytest_cache/",
+    "instance/",
+    ".webassets-cache/",
+    ".scrapy/",
+    "docs/_build/",
+    "target/",
+    ".ipynb_checkpoints/",
+    "profile_default/",
+    ".python-version",
+    "__pypackages__/",
+    ".env",
+    ".venv/",
+    "env/",
+    "venv/",
+    "ENV/",
+    "env.bak/",
+    "venv.bak/",
+    ".spyderproject",
+    ".spyproject",
+    ".ropeproject/",
+    "site/",
+    ".mypy_cache/",
+    ".pyre/",
+    "*.xml",
+    "*.gif",
+]
+
+# 目录模式去掉末尾的"/"后与文件模式一样按路径的单个部分匹配
+IGNORE_RE = re.compile(
+    "|".join(fnmatch.translate(pattern.rstrip("/")) for pattern in IGNORE_PATTERNS)
+)
+
 
-FILE_CONTAINING_NODE_CACHE = {}
+@functools.lru_cache(maxsize=4096)
+def _is_ignored(part: str) -> bool:
+    return IGNORE_RE.match(part) is not None
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True, frozen=True)
 class Import:
     node_name: str
     import_: str
     alias: str = ""
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True, frozen=True)
 class Inherit:
     class_node: Node
     superclass_name: str
 
 
+@dataclasses.dataclass(slots=True)
+class _Definition:
+    """类、函数或变量定义在文件中的字节范围，用于按所在定义归类引用名称"""
+
+    name: str
+    start_byte: int
+    end_byte: int
+    reference_names: list[str] = dataclasses.field(default_factory=list)
+    # 类中定义的方法
+    members: list["_Definition"] = dataclasses.field(default_factory=list)
+
+
 class Parser:
     def __init__(self, db: Database, repo_path: str, module_search_paths: list[str]):
         self.db: Database = db
         self.repo_path: str = repo_path
         self.module_search_paths: list[str] = module_search_paths
-
-        self.nodes: OrderedDict[str, Node] = OrderedDict()
+        # 已知的 Python 文件集合，用于代替逐个 os.path.isfile 探测
+        self._known_files: set[str] = set()
+        for search_path in module_search_paths:
+            self._scan_python_files(search_path)
+
+        self.nodes: dict[str, Node] = {}
+        # 已解析但尚未写入数据库的节点
+        self._pending_nodes: dict[str, Node] = {}
         self.relationships: list[Relation] = []
         self.file_imports: dict[Node, list[Import]] = defaultdict(list)
         self.file_inherits: dict[Node, list[Inherit]] = defaultdict(list)
+        # 定义节点(类、函数、变量)名称 -> 其代码中引用的名称
+        self.reference_names: dict[str, list[str]] = {}
+        self._definitions: list[_Definition] = []
+        # 文件节点名称 -> 该文件直接包含或导入的节点及关系
+        self._containing_cache: dict[str, list[tuple[Node, Relationship]]] = {}
+        self._reference_targets_cache: dict[
+            str, dict[str, list[tuple[str, Node, Relationship]]]
+        ] = {}
+        self._tree_cache: dict[str, tuple[tree_sitter.Tree, bytes]] = {}
+        # 文件节点名称 -> 读入但尚未解析的源码字节
+        self._file_sources: dict[str, bytes] = {}
+        self._module_file_paths: dict[str, tuple[str, bool]] = {}
+        self._resolved_module_names: dict[str, str] = {}
+        self._parsed_lib_nodes: set[str] = set()
+        # 库节点名称 -> (文件修改时间, 节点)
+        self._lib_cache: dict[str, tuple[float, Node]] | None = None
+
+        # 模块级节点类型(kind id)到处理函数的映射
+        self._top_level_handlers = {
+            IMPORT_STATEMENT: self._handle_import,
+            IMPORT_FROM_STATEMENT: self._handle_from_import,
+            EXPRESSION_STATEMENT: self._handle_variable,
+            FUNCTION_DEFINITION: self._handle_function,
+            CLASS_DEFINITION: self._handle_class,
+        }
 
     def _add_node(self, node: Node) -> None:
         self.nodes[node.name] = node
+        self._pending_nodes[node.name] = node
+
+    def flush(self) -> None:
+        """把尚未写入的节点和关系写入数据库(先写节点，关系依赖节点)"""
+        self.db.batch_add_nodes(*self._pending_nodes.values())
+        self._pending_nodes.clear()
+        self.db.batch_add_relationships(*self.relationships)
+        self.relationships.clear()
+
+    def _tree_for(self, file_node: Node) -> tuple[tree_sitter.Tree, bytes]:
+        """Return the syntax tree and source bytes of the file, parsing it only once."""
+        cached = self._tree_cache.get(file_node.name)
+        # 优先使用读文件时的原始字节，省去一次 encode；
+        # 已有语法树时也要丢弃，以免一直占用内存
+        src = self._file_sources.pop(file_node.name, None)
+        if cached is None:
+            if src is None:
+                src = file_node.code.encode()
+            cached = parser.parse(src, encoding="utf8"), src
+            self._tree_cache[file_node.name] = cached
+        return cached
 
     def parse_code(self, file_node: Node):
         """解析源代码并提取模块级元素"""
-        tree = parser.parse(file_node.code.encode(), encoding="utf8")
-
-        # 遍历根节点的所有子节点
-        for child in tree.root_node.children:
-            # 处理import语句
-            match child.type:
-                case "import_statement":
-                    imps = self.parse_import(file_node, child)
-                    self.file_imports[file_node].extend(imps)
+        tree, src = self._tree_for(file_node)
+
+        # 遍历根节点的所有子节点，按节点类型分发处理
+        self._definitions = []
+        for child in _iter_children(tree.root_node):
+            handler = self._top_level_handlers.get(child.kind_id)
+            if handler:
+                handler(file_node, child, src)
+
+        self._collect_reference_names(tree)
+
+    def _collect_reference_names(self, tree: tree_sitter.Tree) -> None:
+        """对整个文件执行一次引用查询，再按字节范围把引用名称分配给所在的定义"""
+        definitions = self._definitions
+        starts = [d.start_byte for d in definitions]
+        member_starts = [[m.start_byte for m in d.members] for d in definitions]
+
+        captures = QUERY.captures(tree.root_node).get("name.reference", [])
+        for capture in captures:
+            i = _find_enclosing(definitions, starts, capture.start_byte)
+            if i < 0:
+                continue
+            name = capture.text.decode()
+            definition = definitions[i]
+            definition.reference_names.append(name)
 
-                case "import_from_statement":
-                    imps = self.parse_from_import(file_node, child)
-                    self.file_imports[file_node].extend(imps)
+            # 方法的引用同时属于所在的类
+            j = _find_enclosing(
+                definition.members, member_starts[i], capture.start_byte
+            )
+            if j >= 0:
+                definition.members[j].reference_names.append(name)
+
+        # 同名的定义以最后一个为准，与 self.nodes 保持一致
+        for definition in definitions:
+            self.reference_names[definition.name] = definition.reference_names
+            for member in definition.members:
+                self.reference_names[member.name] = member.reference_names
+
+    # 处理import语句
+    def _handle_import(self, file_node: Node, child: tree_sitter.Node, src: bytes):
+        imps = self.parse_import(file_node, child)
+        self.file_imports[file_node].extend(imps)
+
+    def _handle_from_import(
+        self, file_node: Node, child: tree_sitter.Node, src: bytes
+    ):
+        imps = self.parse_from_import(file_node, child)
+        self.file_imports[file_node].extend(imps)
+
+    # 提取模块级变量定义
+    def _handle_variable(self, file_node: Node, child: tree_sitter.Node, src: bytes):
+        node = self.parse_variable(file_node, child, src)
+        if node:
+            assignment = child.child(0)
+            self._definitions.append(
+                _Definition(node.name, assignment.start_byte, assignment.end_byte)
+            )
+            self._add_node(node)
+            self.relationships.append(
+                Relationship(
+                    type=EdgeType.CONTAINS,
+                    from_=file_node,
+                    to_=node,
+                )
+            )
 
-                # 提取模块级变量定义
-                case "expression_statement":
-                    node = self.parse_variable(file_node, child)
-                    if node:
-                        self._add_node(node)
-                        self.relationships.append(
-                            Relationship(
-                                type=EdgeType.CONTAINS,
-                                from_=file_node,
-                                to_=node,
-                            )
-                        )
-
-                # 提取函数定义
-                case "function_definition":
-                    node = self.parse_function(file_node, child)
-                    self._add_node(node)
-                    self.relationships.append(
-                        Relationship(
-                            type=EdgeType.CONTAINS,
-                            from_=file_node,
-                            to_=node,
-                        )
-                    )
+    # 提取函数定义
+    def _handle_function(self, file_node: Node, child: tree_sitter.Node, src: bytes):
+        node = self.parse_function(file_node, child, src)
+        self._definitions.append(
+            _Definition(node.name, child.start_byte, child.end_byte)
+        )
+        self._add_node(node)
+        self.relationships.append(
+            Relationship(
+                type=EdgeType.CONTAINS,
+                from_=file_node,
+                to_=node,
+            )
+        )
 
-                # 提取类定义
-                case "class_definition":
-                    node = self.parse_class(file_node, child)
-                    self._add_node(node)
-                    self.relationships.append(
-                        Relationship(
-                            type=EdgeType.CONTAINS,
-                            from_=file_node,
-                            to_=node,
-                        )
-                    )
+    # 提取类定义
+    def _handle_class(self, file_node: Node, child: tree_sitter.Node, src: bytes):
+        node = self.parse_class(file_node, child, src)
+        definition = _Definition(node.name, child.start_byte, child.end_byte)
+        self._definitions.append(definition)
+        self._add_node(node)
+        self.relationships.append(
+            Relationship(
+                type=EdgeType.CONTAINS,
+                from_=file_node,
+                to_=node,
+            )
+        )
 
-                    superclasses_node = child.child_by_field_name("superclasses")
-                    if superclasses_node:
-                        for item in superclasses_node.children:
-                            # class A(Base) or class A(mod.Base)
-                            if item.type in ("identifier", "attribute"):
-                                superclass_name = item.text.decode().strip()
-                                self.file_inherits[file_node].append(
-                                    Inherit(
-                                        class_node=node,
-                                        superclass_name=superclass_name,
-                                    )
-                                )
-
-                    cls_body_node = child.child_by_field_name("body")
-                    for body_child in cls_body_node.children:
-                        match body_child.type:
-                            case "function_definition":
-                                meth_node = self.parse_method(node, body_child)
-                                self._add_node(meth_node)
-                                self.relationships.append(
-                                    Relationship(
-                                        type=EdgeType.CONTAINS,
-                                        from_=node,
-                                        to_=meth_node,
-                                    )
-                                )
+        superclasses_node = child.child_by_field_id(FIELD_SUPERCLASSES)
+        if superclasses_node:
+            inherits: set[Inherit] = set()
+            for item in _iter_children(superclasses_node):
+                # class A(Base) or class A(mod.Base)
+                if item.type in ("identifier", "attribute"):
+                    superclass_name = item.text.decode().strip()
+                    inherit = Inherit(
+                        class_node=node,
+                        superclass_name=superclass_name,
+                    )
+                    # 忽略重复列出的父类
+                    if inherit not in inherits:
+                        inherits.add(inherit)
+                        self.file_inherits[file_node].append(inherit)
+
+        cls_body_node = child.child_by_field_id(FIELD_BODY)
+        for body_child in _iter_children(cls_body_node):
+            if body_child.kind_id == FUNCTION_DEFINITION:
+                meth_node = self.parse_method(node, body_child, src)
+                definition.members.append(
+                    _Definition(
+                        meth_node.name, body_child.start_byte, body_child.end_byte
+                    )
+                )
+                self._add_node(meth_node)
+                self.relationships.append(
+                    Relationship(
+                        type=EdgeType.CONTAINS,
+                        from_=node,
+                        to_=meth_node,
+                    )
+                )
 
     def parse_import(self, file_node: Node, child: tree_sitter.Node) -> list[Node]:
         # 处理普通import语句(如import os, sys)
         imps: list[Node] = []
 
-        for import_item in child.children[1:]:
-            if import_item.type == ",":
+        for import_item in _iter_children(child, start=1):
+            name_alias = _import_name_alias(import_item)
+            if not name_alias:
                 continue
-            module_name = import_item.text.decode().strip()
-            alias = ""
-            if " as " in module_name:
-                module_name, alias = module_name.split(" as ")
+            module_name, alias = name_alias
             imps.append(
                 Import(
-                    node_name=self.resolve_module_name(module_name),
+                    node_name=module_name,  # resolved later by `resolve_imports`
                     import_=module_name,
                     alias=alias,
                 )
@@ -158,19 +381,18 @@ class Parser:
         # 处理from...import语句(如from collections import defaultdict)
         imps: list[Node] = []
 
-        module_path = child.children[1].text.decode().strip()
-        for import_item in child.children[3:]:
-            if import_item.type == ",":
+        module_path = child.child(1).text.decode().strip()
+        for import_item in _iter_children(child, start=3):
+            name_alias = _import_name_alias(import_item)
+            if not name_alias:
                 continue
-            import_name = import_item.text.decode().strip()
-            module_name = f"{module_path}.{import_name}"
-            alias = ""
-            if " as " in module_name:
-                module_name, alias = module_name.split(" as ")
-            module_name = self.relative_to_absolute(file_node.name, module_name)
+            import_name, alias = name_alias
+            module_name = self.relative_to_absolute(
+                file_node.name, f"{module_path}.{import_name}"
+            )
             imps.append(
                 Import(
-                    node_name=self.resolve_module_name(module_name),
+                    node_name=module_name,  # resolved later by `resolve_imports`
                     import_=import_name,
                     alias=alias,
                 )
@@ -178,56 +400,62 @@ class Parser:
 
         return imps
 
-    def parse_variable(self, file_node: Node, child: tree_sitter.Node) -> Node | None:
-        assignment = child.children[0]
+    def parse_variable(
+        self, file_node: Node, child: tree_sitter.Node, src: bytes
+    ) -> Node | None:
+        assignment = child.child(0)
         if assignment.type == "augmented_assignment":
             # Skip for now
             return None
-        identifier = assignment.child_by_field_name("left")
+        identifier = assignment.child_by_field_id(FIELD_LEFT)
         if not identifier:
             return None
 
         var_name = identifier.text.decode()
-        code = assignment.text.decode()
+        code = src[assignment.start_byte : assignment.end_byte].decode()
         return Node(
             type=NodeType.VARIABLE,
-            name=f"{file_node.name}:{var_name}",
+            name=sys.intern(f"{file_node.name}:{var_name}"),
             code=code,
             start=self._create_point(identifier.start_point),
             end=self._create_point(identifier.end_point),
         )
 
-    def parse_function(self, file_node: Node, child: tree_sitter.Node) -> Node:
-        name_node = child.child_by_field_name("name")
+    def parse_function(
+        self, file_node: Node, child: tree_sitter.Node, src: bytes
+    ) -> Node:
+        name_node = child.child_by_field_id(FIELD_NAME)
         func_name = name_node.text.decode().strip()
-        code = child.text.decode()
+        code = src[child.start_byte : child.end_byte].decode()
         return Node(
             type=NodeType.FUNCTION,
-            name=f"{file_node.name}:{func_name}",
+            name=sys.intern(f"{file_node.name}:{func_name}"),
             code=code,
             start=self._create_point(child.start_point),
             end=self._create_point(child.end_point),
         )
 
-    def parse_class(self, file_node: Node, child: tree_sitter.Node) -> Node:
-        name_node = child.child_by_field_name("name")
+    def parse_class(self, file_node: Node, child: tree_sitter.Node, src: bytes) -> Node:
+        name_node = child.child_by_field_id(FIELD_NAME)
         class_name = name_node.text.decode().strip()
-        code = child.text.decode()
+        code = src[child.start_byte : child.end_byte].decode()
         return Node(
             type=NodeType.CLASS,
-            name=f"{file_node.name}:{class_name}",
+            name=sys.intern(f"{file_node.name}:{class_name}"),
             code=code,
             start=self._create_point(child.start_point),
             end=self._create_point(child.end_point),
         )
 
-    def parse_method(self, class_node: Node, child: tree_sitter.Node) -> Node:
-        name_node = child.child_by_field_name("name")
+    def parse_method(
+        self, class_node: Node, child: tree_sitter.Node, src: bytes
+    ) -> Node:
+        name_node = child.child_by_field_id(FIELD_NAME)
         func_name = name_node.text.decode().strip()
-        code = child.text.decode()
+        code = src[child.start_byte : child.end_byte].decode()
         return Node(
             type=NodeType.FUNCTION,
-            name=f"{class_node.name}.{func_name}",
+            name=sys.intern(f"{class_node.name}.{func_name}"),
             code=code,
             start=self._create_point(child.start_point),
             end=self._create_point(child.end_point),
@@ -239,7 +467,9 @@ class Parser:
             column=ts_point[1] + 1,  # 0-based to 1-based column number
         )
 
-    def relative_to_absolute(self, current_file_path: str, module_name: str) -> str:
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def relative_to_absolute(current_file_path: str, module_name: str) -> str:
         """
         将相对模块名转换为绝对模块名
 
@@ -261,18 +491,12 @@ class Parser:
             # absolute import
             return module_name  # 不是相对导入
 
-        # 计算基础路径(向上level-1级)
-        base_path = os.path.dirname(current_file_path)
-        for _ in range(level - 1):
-            base_path = os.path.dirname(base_path)
+        # 计算基础包(去掉文件名后再向上level-1级)，直接在路径的各部分上操作
+        path_parts = current_file_path.split(os.sep)
+        base_parts = path_parts[: max(len(path_parts) - level, 0)]
 
-        # 获取模块剩余部分
-        module_parts = parts[level:]
-        # 构建绝对路径
-        absolute_path = os.path.join(base_path, *module_parts)
-
-        # 转换为模块格式(替换路径分隔符为点)
-        return absolute_path.replace(os.sep, ".")
+        # 拼接模块剩余部分，构建绝对模块名
+        return ".".join(base_parts + parts[level:])
 
     def _get_module_file_path(self, module_name: str) -> tuple[str, bool]:
         """
@@ -285,7 +509,13 @@ class Parser:
             str: 模块文件的相对路径(相对于repo_path)，如果未找到则返回空字符串
             bool: 是否位于标准库或三方库
         """
+        result = self._module_file_paths.get(module_name)
+        if result is None:
+            result = self._find_module_file_path(module_name)
+            self._module_file_paths[module_name] = result
+        return result
 
+    def _find_module_file_path(self, module_name: str) -> tuple[str, bool]:
         base_paths = [self.repo_path] + self.module_search_paths
         candidates = [
             module_name.replace(".", os.sep) + ".py",
@@ -294,7 +524,7 @@ class Parser:
         for base_path in base_paths:
             for candidate in candidates:
                 path = os.path.join(base_path, candidate)
-                if os.path.isfile(path):
+                if os.path.normpath(path) in self._known_files:
                     in_repo = path.startswith(self.repo_path)
                     if in_repo:
                         return os.path.relpath(path, self.repo_path), False
@@ -304,33 +534,50 @@ class Parser:
 
         return "", False
 
+    def _scan_python_files(self, path: str) -> None:
+        """遍历目录，记录其中所有的 Python 文件"""
+        for base, _, files in os.walk(path):
+            for file in files:
+                if file.endswith(".py"):
+                    self._known_files.add(os.path.normpath(os.path.join(base, file)))
+
     def parse_lib_node(self, node_name: str) -> None:
+        # 同一个库节点只需解析并写入一次
+        if node_name in self._parsed_lib_nodes:
+            return
+        self._parsed_lib_nodes.add(node_name)
+
         def _parse() -> Node:
             file_path, attribute_name = node_name, ""
             if ":" in file_path:
                 file_path, attribute_name = file_path.rsplit(":", 1)
 
-            file_node = self._parse_file(file_path)
             if not attribute_name:
-                file_node.code = ""  # Do not store the code of stdlib or 3rd-lib
-                return file_node
+                # Do not store the code of stdlib or 3rd-lib, so no need to read the file
+                return Node(name=file_path, type=NodeType.FILE)
+
+            if file_path in self._tree_cache:
+                # 语法树和源码已缓存，无需再次读取文件
+                file_node = Node(name=file_path, type=NodeType.FILE)
+            else:
+                file_node = self._parse_file(file_path)
 
             # function or class
-            tree = parser.parse(file_node.code.encode(), encoding="utf8")
+            tree, src = self._tree_for(file_node)
 
             # 遍历根节点的所有子节点
-            for child in tree.root_node.children:
+            for child in _iter_children(tree.root_node):
                 # 处理import语句
                 match child.type:
                     # 提取函数定义
                     case "function_definition":
-                        node = self.parse_function(file_node, child)
+                        node = self.parse_function(file_node, child, src)
                         if node.name == attribute_name:
                             return node
 
                     # 提取类定义
                     case "class_definition":
-                        node = self.parse_class(file_node, child)
+                        node = self.parse_class(file_node, child, src)
                         if node.name == attribute_name:
                             return node
 
@@ -338,9 +585,47 @@ class Parser:
             # set the type to unknown for now
             return Node(type=NodeType.UNPARSED, name=node_name)
 
-        node = _parse()
+        # 库文件基本不会变化，文件修改时间没变就复用之前运行解析出的节点
+        lib_cache = self._get_lib_cache()
+        mtime = os.path.getmtime(node_name.rsplit(":", 1)[0])
+        cached = lib_cache.get(node_name)
+        if cached is not None and cached[0] == mtime:
+            node = cached[1]
+        else:
+            node = _parse()
+            lib_cache[node_name] = (mtime, node)
         self.db.upsert_node(node)
 
+    def _get_lib_cache(self) -> dict[str, tuple[float, Node]]:
+        # 只在第一次需要时加载，工作进程中的解析器不会用到
+        if self._lib_cache is None:
+            try:
+                with open(LIB_CACHE_PATH, "rb") as f:
+                    self._lib_cache = pickle.load(f)
+            except (
+                FileNotFoundError,
+                EOFError,
+                pickle.UnpicklingError,
+                AttributeError,
+            ):
+                # 缓存不存在或已失效(如 Node 结构有变化)，重新解析即可
+                self._lib_cache = {}
+        return self._lib_cache
+
+    def save_lib_cache(self) -> None:
+        if self._lib_cache is None:
+            return
+        # 只保留本次运行用到的节点，避免缓存无限增长
+        lib_cache = {
+            name: entry
+            for name, entry in self._lib_cache.items()
+            if name in self._parsed_lib_nodes
+        }
+        tmp_path = f"{LIB_CACHE_PATH}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(lib_cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, LIB_CACHE_PATH)
+
     def resolve_module_name(self, module_name: str) -> str:
         """
         Resolve the module name to the actual name of the destination node (file or class or function).
@@ -351,6 +636,13 @@ class Parser:
         返回:
             解析后的节点名称，如果解析失败则返回None
         """
+        node_name = self._resolved_module_names.get(module_name)
+        if node_name is None:
+            node_name = self._resolve_module_name(module_name)
+            self._resolved_module_names[module_name] = node_name
+        return node_name
+
+    def _resolve_module_name(self, module_name: str) -> str:
         # 尝试解析整个路径作为模块
         file_path, in_lib = self._get_module_file_path(module_name)
         if file_path:
@@ -371,10 +663,26 @@ class Parser:
         # 未识别的模块，暂时无法解析具体文件路径，原样返回
         return module_name
 
+    def resolve_imports(self, file_node: Node) -> None:
+        """Resolve the module names collected by `parse_code` to the actual node names."""
+        imps = self.file_imports.get(file_node)
+        if not imps:
+            return
+        # 同一文件中重复的导入(解析后完全相同)只保留一个，顺序不变
+        self.file_imports[file_node] = list(
+            dict.fromkeys(
+                dataclasses.replace(
+                    imp, node_name=self.resolve_module_name(imp.node_name)
+                )
+                for imp in imps
+            )
+        )
+
     def parse_file(self, file_path: str, base_path: str = "") -> Node:
         """处理单个文件并返回解析结果"""
         file_node = self._parse_file(file_path, base_path)
         self.parse_code(file_node)
+        self.resolve_imports(file_node)
         return file_node
 
     def _parse_file(self, file_path: str, base_path: str = "") -> Node:
@@ -385,93 +693,22 @@ class Parser:
         if base_path:
             rel_file_path = os.path.relpath(file_path, base_path)
 
+        self._file_sources[rel_file_path] = source_code
         return Node(name=rel_file_path, type=NodeType.FILE, code=source_code.decode())
 
     @staticmethod
     def filter_path(path: str) -> bool:
         """参考.gitignore过滤路径"""
-        ignore_patterns = [
-            # 默认忽略的目录
-            "__pycache__",
-            "tests",
-            "test",
-            "venv",
-            "env",
-            # 从.gitignore提取的规则
-            ".DS_Store",
-            "results/",
-            "*.py[cod]",
-            "*$py.class",
-            "*.so",
-            "build/",
-            "develop-eggs/",
-            "dist/",
-            "downloads/",
-            "eggs/",
-            ".eggs/",
-            "lib/",
-            "lib64/",
-            "parts/",
-            "sdist/",
-            "var/",
-            "wheels/",
-            "pip-wheel-metadata/",
-            "share/python-wheels/",
-            "*.egg-info/",
-            "*.egg",
-            "htmlcov/",
-            ".tox/",
-            ".nox/",
-            ".coverage",
-            ".coverage.*",
-            ".cache",
-            ".hypothesis/",
-            ".pytest_cache/",
-            "instance/",
-            ".webassets-cache/",
-            ".scrapy/",
-            "docs/_build/",
-            "target/",
-            ".ipynb_checkpoints/",
-            "profile_default/",
-            ".python-version",
-            "__pypackages__/",
-            ".env",
-            ".venv/",
-            "env/",
-            "venv/",
-            "ENV/",
-            "env.bak/",
-            "venv.bak/",
-            ".spyderproject",
-            ".spyproject",
-            ".ropeproject/",
-            "site/",
-            ".mypy_cache/",
-            ".pyre/",
-            "*.xml",
-            "*.gif",
-        ]
-
-        # 检查路径是否匹配任何忽略模式
-        path_parts = path.split(os.sep)
-        for part in path_parts:
-            for pattern in ignore_patterns:
-                # 处理目录模式(以/结尾)
-                if pattern.endswith("/"):
-                    if fnmatch.fnmatch(part, pattern[:-1]):
-                        return False
-                else:
-                    if fnmatch.fnmatch(part, pattern):
-                        return False
-        return True
+        # 检查路径的每一部分是否匹配任何忽略模式
+        return not any(_is_ignored(part) for part in path.split(os.sep))
 
-    def parse_path(self, path: str, root: str = ""):
+    def parse_path(self, path: str, root: str = "", max_workers: int | None = None):
         """处理指定路径(文件或目录)并返回解析结果"""
         if not self.filter_path(path):
             return
 
         if os.path.isfile(path):
+            self._add_known_files([path])
             file_node = self.parse_file(path, root)
             self._add_node(file_node)
             return
@@ -480,6 +717,8 @@ class Parser:
         dir_node = self.create_directory_node(path, root)
         self._add_node(dir_node)
         parent_nodes = {path: dir_node}  # 缓存父目录节点
+        file_paths: list[str] = []
+        file_dir_nodes: list[Node] = []
 
         for base, dirs, files in os.walk(path):
             # 先过滤不需要的目录
@@ -488,21 +727,13 @@ class Parser:
             # 获取当前目录节点(已缓存)
             current_dir_node = parent_nodes[base]
 
-            # 处理文件
+            # 收集文件，稍后并行解析
             for file in files:
                 file_path = os.path.join(base, file)
                 if not file_path.endswith(".py"):
                     continue
-
-                file_node = self.parse_file(file_path, root)
-                self._add_node(file_node)
-                self.relationships.append(
-                    Relationship(
-                        type=EdgeType.CONTAINS,
-                        from_=current_dir_node,
-                        to_=file_node,
-                    )
-                )
+                file_paths.append(file_path)
+                file_dir_nodes.append(current_dir_node)
 
             # 处理子目录并建立关系
             for dir in dirs:
@@ -519,31 +750,97 @@ class Parser:
                 # 缓存子目录节点供后续使用
                 parent_nodes[dir_path] = child_dir_node
 
-    def resolve_superclass_name(self, inherit: Inherit, file_node: Node) -> str:
+        self._add_known_files(file_paths)
+
+        # Files are parsed independently of each other, so spread them over
+        # worker processes. Imports are resolved here afterwards, since that
+        # needs the database.
+        with contextlib.ExitStack() as stack:
+            if len(file_paths) < PARALLEL_MIN_FILES or max_workers == 1:
+                results = map(_parse_one, file_paths, itertools.repeat(root))
+            else:
+                # No more workers than there are chunks of files to parse
+                max_workers = min(
+                    max_workers or os.cpu_count() or 1,
+                    -(-len(file_paths) // PARSE_CHUNK_SIZE),
+                )
+                # The open database runs threads of its own, and forking a
+                # multi-threaded process may deadlock the children.
+                executor = stack.enter_context(
+                    concurrent.futures.ProcessPoolExecutor(
+                        max_workers,
+                        mp_context=multiprocessing.get_context("forkserver"),
+                    )
+                )
+                results = executor.map(
+                    _parse_one,
+                    file_paths,
+                    itertools.repeat(root),
+                    chunksize=PARSE_CHUNK_SIZE,
+                )
+            for i, (current_dir_node, result) in enumerate(
+                zip(file_dir_nodes, results), 1
+            ):
+                (
+                    file_node,
+                    nodes,
+                    relationships,
+                    imps,
+                    inherits,
+                    reference_names,
+                ) = result
+                self._add_node(file_node)
+                for node in nodes:
+                    self._add_node(node)
+                self.relationships.extend(relationships)
+                self.reference_names.update(reference_names)
+                self.relationships.append(
+                    Relationship(
+                        type=EdgeType.CONTAINS,
+                        from_=current_dir_node,
+                        to_=file_node,
+                    )
+                )
+                if imps:
+                    self.file_imports[file_node].extend(imps)
+                    self.resolve_imports(file_node)
+                if inherits:
+                    self.file_inherits[file_node].extend(inherits)
+
+                # 分批写入已解析文件的节点和关系，避免全部堆积在内存中
+                if i % FLUSH_FILE_COUNT == 0:
+                    self.flush()
+
+    def _add_known_files(self, file_paths: list[str]) -> None:
+        self._known_files.update(os.path.normpath(p) for p in file_paths)
+        # 新增文件可能改变之前的解析结果
+        self._module_file_paths.clear()
+        self._resolved_module_names.clear()
+
+    def resolve_superclass_name(
+        self,
+        inherit: Inherit,
+        file_node: Node,
+        file_imports: list[tuple[str, str, str, str]],
+        existing_names: set[str],
+    ) -> str:
         """
         Resolve the superclass name to the actual name of the superclass node.
+
+        `file_imports` holds (name, type, import, alias) of the nodes linked to the file by
+        IMPORTS, and `existing_names` the node names known to exist in the database.
         """
         name = inherit.superclass_name
         if "." not in name:
             # cases where superclass is defined inside the file (module) itself
             node_name = f"{file_node.name}:{name}"
-            if self.db.has_node(node_name):
+            if node_name in existing_names:
                 return node_name
 
             # cases where superclass might be imported from another module
-            result = self.db.execute(
-                """
-                MATCH (a)-[b:IMPORTS]-(c)
-                WHERE a.name = $name AND c.type IN ['class', 'unparsed']
-                RETURN c.name, b.alias;
-                """,
-                parameters={"name": file_node.name},
-            )
-            if not result:
-                return ""
-
-            for r in result:
-                imp_node_name, imp_node_alias = r
+            for imp_node_name, imp_node_type, _, imp_node_alias in file_imports:
+                if imp_node_type not in (NodeType.CLASS, NodeType.UNPARSED):
+                    continue
                 imp_class_name = imp_node_alias or imp_node_name.split(":")[-1]
                 if imp_class_name == name:
                     return imp_node_name
@@ -551,45 +848,87 @@ class Parser:
             return ""
 
         # cases where superclass might be from an imported module
-        result = self.db.execute(
-            """
-            MATCH (a)-[b:IMPORTS]-(c)
-            WHERE a.name = $name AND c.type = 'file'
-            RETURN c.name, b.import, b.alias;
-            """,
-            parameters={"name": file_node.name},
-        )
-        if not result:
-            return ""
-
         mod_name, superclass_name = name.rsplit(".", 1)
-        for imp_node_name, imp_node_import, imp_node_alias in result:
+        for imp_node_name, imp_node_type, imp_node_import, imp_node_alias in file_imports:
+            if imp_node_type != NodeType.FILE:
+                continue
             if mod_name == (imp_node_alias or imp_node_import):
                 return f"{imp_node_name}:{superclass_name}"
 
         return ""
 
+    def _get_file_imports(
+        self, file_names: list[str]
+    ) -> dict[str, list[tuple[str, str, str, str]]]:
+        """一次查询取出各文件通过 IMPORTS 关联的节点(名称、类型、导入名、别名)"""
+        file_imports: dict[str, list[tuple[str, str, str, str]]] = defaultdict(list)
+        if not file_names:
+            return file_imports
+
+        result = self.db.execute(
+            """
+            UNWIND $names AS name
+            MATCH (a {name: name})-[b:IMPORTS]-(c)
+            RETURN a.name, c.name, c.type, b.import, b.alias;
+            """,
+            parameters={"names": file_names},
+        )
+        for file_name, *imp in result:
+            file_imports[file_name].append(tuple(imp))
+        return file_imports
+
     def _get_containing_node(self, node: Node) -> list[Node]:
-        containing_nodes = FILE_CONTAINING_NODE_CACHE.get(node.name)
-        if not containing_nodes:
+        containing_nodes = self._containing_cache.get(node.name)
+        if containing_nodes is None:
             containing_nodes = self.db.traverse_nodes(
                 node.name,
                 "downstream",
                 relationship_type_filter=[EdgeType.IMPORTS, EdgeType.CONTAINS],
             )
-            FILE_CONTAINING_NODE_CACHE[node.name] = containing_nodes
+            self._containing_cache[node.name] = containing_nodes
         return containing_nodes
 
+    def _get_reference_targets(
+        self, node: Node
+    ) -> dict[str, list[tuple[str, Node, Relationship]]]:
+        """按名称(导入名、别名或短名称)的第一段对文件包含或导入的节点分组"""
+        targets = self._reference_targets_cache.get(node.name)
+        if targets is None:
+            targets = defaultdict(list)
+            for n, r in self._get_containing_node(node):
+                if r.type == EdgeType.IMPORTS:
+                    target_name = r.alias or r.import_
+                else:
+                    target_name = n.short_names[0]
+                targets[target_name.partition(".")[0]].append((target_name, n, r))
+            self._reference_targets_cache[node.name] = targets
+        return targets
+
+    def _prewarm_containing_cache(self, file_names: list[str]) -> None:
+        """一次查询取出所有文件直接包含或导入的节点，预先填充缓存"""
+        if not file_names:
+            return
+
+        result = self.db.execute(
+            """
+            UNWIND $names AS name
+            MATCH (a:File {name: name})-[b:IMPORTS|:CONTAINS]->(c)
+            RETURN a.name, b, c;
+            """,
+            parameters={"names": file_names},
+        )
+        containing: dict[str, list[tuple[Node, Relationship]]] = {
+            name: [] for name in file_names
+        }
+        for file_name, rel, node in result:
+            containing[file_name].append(
+                (Node.from_dict(node), Relationship.from_dict(rel))
+            )
+        self._containing_cache.update(containing)
+
     def resolve_reference_relationships(self, node: Node) -> list[Relationship]:
         referenced_nodes: set[Node] = set()
 
-        def parse_reference_names(code: str) -> list[str]:
-            tree = parser.parse(code.encode(), encoding="utf8")
-            captures = QUERY.captures(tree.root_node)
-            if not captures:
-                return []
-            return [n.text.decode() for n in captures["name.reference"]]
-
         def resolve(node: Node, reference_names: list[str]):
             result = self.db.traverse_nodes(
                 node.name,
@@ -602,19 +941,25 @@ class Parser:
                 return
             parent_file_node = result[0][0]
 
-            containing_nodes = self._get_containing_node(parent_file_node)
-            for n, r in containing_nodes:
-                for name in reference_names:
+            targets = self._get_reference_targets(parent_file_node)
+            for name in reference_names:
+                head = name.partition(".")[0]
+                for target_name, n, r in targets.get(head, ()):
+                    # 引用名称须为 target_name 本身，或以 target_name 加 "." 开头
+                    if name != target_name and not (
+                        name.startswith(target_name) and name[len(target_name)] == "."
+                    ):
+                        continue
+
                     match r.type:
                         case EdgeType.IMPORTS:
-                            imp_name = r.alias or r.import_
-                            if name == imp_name:
+                            if name == target_name:
                                 # Reference module-level class/function/variable imported from a file (module)
                                 referenced_nodes.add(n)
-                            elif name.startswith(imp_name):
+                            else:
                                 # Reference module-level class/function/variable from an imported file (module)
                                 attr_name = name[
-                                    len(imp_name) + 1 :
+                                    len(target_name) + 1 :
                                 ]  # Remove one more "."
                                 if n.type == NodeType.FILE:
                                     # attribute from file
@@ -644,12 +989,11 @@ class Parser:
 
                         case EdgeType.CONTAINS:
                             # Reference module-level class or function or variable defined in the same file (module)
-                            n_short_name = n.short_names[0]
-                            if name == n_short_name:
+                            if name == target_name:
                                 referenced_nodes.add(n)
-                            elif name.startswith(n_short_name):
+                            else:
                                 attr_name = name[
-                                    len(n_short_name) + 1 :
+                                    len(target_name) + 1 :
                                 ]  # Remove one more "."
                                 if n.type == NodeType.CLASS:
                                     # methods from class
@@ -674,21 +1018,10 @@ class Parser:
                                 if attr_node:
                                     referenced_nodes.add(attr_node)
 
-        match node.type:
-            case NodeType.CLASS:
-                names = parse_reference_names(node.code)
-                if names:
-                    resolve(node, names)
-
-            case NodeType.FUNCTION:
-                names = parse_reference_names(node.code)
-                if names:
-                    resolve(node, names)
-
-            case NodeType.VARIABLE:
-                names = parse_reference_names(node.code)
-                if names:
-                    resolve(node, names)
+        # 引用名称已在解析文件时收集(只有类、函数、变量才有)
+        names = self.reference_names.get(node.name)
+        if names:
+            resolve(node, names)
 
         return [
             Relationship(
@@ -705,17 +1038,17 @@ class Parser:
         return Node(name=rel_path, type=NodeType.DIRECTORY)
 
     def save_to_db(self, output: str) -> None:
-        # Save nodes
-        self.db.batch_add_nodes(*self.nodes.values())
-
-        # Save CONTAINS relationships
-        self.db.batch_add_relationships(*self.relationships)
+        # Save the nodes and CONTAINS relationships not flushed by `parse_path` yet
+        self.flush()
 
         # Save IMPORTS relationships
         imports_relationships: list[Relationship] = []
+        imp_nodes = self.db.batch_get_nodes(
+            {imp.node_name for imps in self.file_imports.values() for imp in imps}
+        )
         for file_node, imps in self.file_imports.items():
             for imp in imps:
-                imp_node = self.db.get_node(imp.node_name)
+                imp_node = imp_nodes.get(imp.node_name)
                 if not imp_node:
                     continue
                 imports_relationships.append(
@@ -730,32 +1063,54 @@ class Parser:
         self.db.batch_add_relationships(*imports_relationships)
 
         # Save INHERITS relationships
-        inherits_relationships: list[Relationship] = []
+        file_imports = self._get_file_imports(
+            [file_node.name for file_node in self.file_inherits]
+        )
+        existing_names = self.db.batch_has_nodes(
+            f"{file_node.name}:{inherit.superclass_name}"
+            for file_node, inherits in self.file_inherits.items()
+            for inherit in inherits
+            if "." not in inherit.superclass_name
+        )
+        resolved_inherits: list[tuple[Inherit, str]] = []
         for file_node, inherits in self.file_inherits.items():
             for inherit in inherits:
-                superclass_node_name = self.resolve_superclass_name(inherit, file_node)
-                if not superclass_node_name:
-                    continue
+                superclass_node_name = self.resolve_superclass_name(
+                    inherit,
+                    file_node,
+                    file_imports.get(file_node.name, []),
+                    existing_names,
+                )
+                if superclass_node_name:
+                    resolved_inherits.append((inherit, superclass_node_name))
 
-                superclass_node = self.db.get_node(superclass_node_name)
-                if not superclass_node:
-                    # The superclass is from an imported external library, create an UNPARSED node.
-                    superclass_node = Node(
-                        name=superclass_node_name,
-                        type=NodeType.UNPARSED,
-                    )
-                    self.db.upsert_node(superclass_node)
+        superclass_nodes = self.db.batch_get_nodes(
+            name for _, name in resolved_inherits
+        )
+        # The superclass is from an imported external library, create an UNPARSED node.
+        unparsed_nodes = [
+            Node(name=name, type=NodeType.UNPARSED)
+            for name in dict.fromkeys(name for _, name in resolved_inherits)
+            if name not in superclass_nodes
+        ]
+        if unparsed_nodes:
+            self.db.upsert_nodes(*unparsed_nodes)
+            superclass_nodes.update((node.name, node) for node in unparsed_nodes)
 
-                inherits_relationships.append(
-                    Relationship(
-                        type=EdgeType.INHERITS,
-                        from_=inherit.class_node,
-                        to_=superclass_node,
-                    )
-                )
+        inherits_relationships = [
+            Relationship(
+                type=EdgeType.INHERITS,
+                from_=inherit.class_node,
+                to_=superclass_nodes[superclass_node_name],
+            )
+            for inherit, superclass_node_name in resolved_inherits
+        ]
         self.db.batch_add_relationships(*inherits_relationships)
 
         # Save REFERENCES relationships
+        self._prewarm_containing_cache(
+            [n.name for n in self.nodes.values() if n.type == NodeType.FILE]
+        )
         references_relationships: list[Relationship] = []
         for _, node in self.nodes.items():
             relationships = self.resolve_reference_relationships(node)
@@ -772,6 +1127,68 @@ class Parser:
                 references_relationships.extend(relationships)
         self.db.batch_add_relationships(*references_relationships)
 
+        self.save_lib_cache()
+
+
+def _find_enclosing(definitions: list[_Definition], starts: list[int], byte: int) -> int:
+    """返回包含 byte 的定义的下标(definitions 互不重叠且按起始位置排序)，没有则返回-1"""
+    i = bisect.bisect_right(starts, byte) - 1
+    if i >= 0 and byte < definitions[i].end_byte:
+        return i
+    return -1
+
+
+def _import_name_alias(item: tree_sitter.Node) -> tuple[str, str] | None:
+    """返回导入项的名称和别名，逗号、括号、注释等非导入项返回None"""
+    kind = item.kind_id
+    if kind == ALIASED_IMPORT:
+        name = item.child_by_field_id(FIELD_NAME).text.decode()
+        alias = item.child_by_field_id(FIELD_ALIAS).text.decode()
+        return sys.intern(name), sys.intern(alias)
+    if kind == DOTTED_NAME or kind == WILDCARD_IMPORT:
+        return sys.intern(item.text.decode()), ""
+    return None
+
+
+def _iter_children(
+    node: tree_sitter.Node, start: int = 0
+) -> Iterator[tree_sitter.Node]:
+    """Iterate over the children of node (from index start) with a single TreeCursor."""
+    cursor = node.walk()
+    if not cursor.goto_first_child():
+        return
+    index = 0
+    while True:
+        if index >= start:
+            yield cursor.node
+        index += 1
+        if not cursor.goto_next_sibling():
+            return
+
+
+def _parse_one(
+    file_path: str, base_path: str
+) -> tuple[
+    Node,
+    list[Node],
+    list[Relationship],
+    list[Import],
+    list[Inherit],
+    dict[str, list[str]],
+]:
+    """Parse a single file in a worker process, without touching the database."""
+    file_parser = Parser(db=None, repo_path=base_path, module_search_paths=[])
+    file_node = file_parser._parse_file(file_path, base_path)
+    file_parser.parse_code(file_node)
+    return (
+        file_node,
+        list(file_parser.nodes.values()),
+        file_parser.relationships,
+        file_parser.file_imports.get(file_node, []),
+        file_parser.file_inherits.get(file_node, []),
+        file_parser.reference_names,
+    )
+
 
 def main():
     """主函数"""
@@ -780,6 +1197,7 @@ def main():
     parser.add_argument("--include", help="要解析的Python文件或目录路径")
     parser.add_argument("--mod_search_path", default="", help="模块搜索路径")
     parser.add_argument("--output", default="./output", help="输出目录")
+    parser.add_argument("--workers", type=int, default=None, help="并行解析文件的进程数")
     args = parser.parse_args()
 
     include = args.include or args.repo
@@ -787,11 +1205,11 @@ def main():
     module_search_paths = (
         args.mod_search_path.split(":") if args.mod_search_path else []
     )
-    db = Database("./graph/db", tmp_data="./graph/data")
+    db = Database("./graph/db")
     db.delete_all()
 
     ast_parser = Parser(db, args.repo, module_search_paths)
-    ast_parser.parse_path(include, args.repo)
+    ast_parser.parse_path(include, args.repo, max_workers=args.workers)
     ast_parser.save_to_db(args.output)
 
 
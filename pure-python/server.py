@@ -1,23 +1,47 @@
-from collections import defaultdict
-import json
+from collections import defaultdict, OrderedDict
+import functools
 
 from mcp.server.fastmcp import FastMCP
 import kuzu
+import orjson
 
-from database import Database, Node, NodeType
+from database import Database, EdgeType, NodeType
+
+# Node table names keyed by node type, e.g. "class" => "Class".
+_TYPE_TO_TABLE = {t.value: t.value.title() for t in NodeType}
+
+# The relationship pattern of one traversal hop, keyed by direction.
+_REL_TEMPLATE = {
+    "downstream": "-[b{labels}]->",
+    "upstream": "<-[b{labels}]-",
+    "both": "-[b{labels}]-",
+}
 
 mcp = FastMCP("Demo")
 db = Database("./graph/db")
 
+# The caches below live as long as the server process. The graph cannot change
+# under a running server, since Kuzu locks the database files while it is open.
+
+# Traversal results keyed by (start node, direction, depth, entity types,
+# relationship types), least recently used first.
+TRAVERSAL_CACHE_SIZE = 4096
+_traversal_cache: OrderedDict[tuple, dict[str, list[str]]] = OrderedDict()
+
+# Node types keyed by node name, least recently used first.
+NODE_TYPE_CACHE_SIZE = 65536
+_node_type_cache: OrderedDict[str, str] = OrderedDict()
+
 
 @mcp.tool()
-def locate_entities(search_terms: list[str]) -> str:
+def locate_entities(search_terms: list[str], pretty: bool = False) -> str:
     """Searches the codebase to retrieve the locations of relevant entities (file/class/function) based on given query terms.
 
     Args:
         search_terms (List[str]): A list of names, keywords to search for within the codebase.
             Terms can be formatted as 'file_path:QualifiedName' to search for a specific module or entity within a file
             (e.g., 'src/helpers/math_helpers.py:MathUtils.calculate_sum') or unqualified names to search for occurrences anywhere within the codebase.
+        pretty (bool): Whether to indent the returned JSON. Default is False.
 
     Returns:
         str: The search results, which are the locations of matching entities.
@@ -29,38 +53,53 @@ def locate_entities(search_terms: list[str]) -> str:
         # Search for the location of a specific class
         result = locate_entities(search_terms=['MyClass'])
     """
-    nodes: list[Node] = []
-    for term in search_terms:
-        term = term.strip()
-        term_node = db.get_node(term)
-        if term_node:
-            nodes.append(term_node)
-
-        result = db.execute(
+    terms = [term.strip() for term in search_terms]
+    if not terms:
+        return _dumps([], pretty)
+
+    # Look up all the terms at once, both as full names and as short names,
+    # fetching only the reported properties as Arrow tables instead of nodes.
+    term_rows = db.execute_as_arrow(
+        db.prepare(
             """
-            MATCH (a)
-            WHERE $term IN a.short_names
-            RETURN a;
-            """,
-            parameters={"term": term},
-        )
-        for r in result:
-            node = Node.from_dict(r[0])
-            nodes.append(node)
+            UNWIND $terms AS term
+            MATCH (a {name: term})
+            RETURN a.name AS name, a.type AS type,
+                   a.start_line AS start_line, a.end_line AS end_line;
+            """
+        ),
+        parameters={"terms": terms},
+    ).to_pylist()
+    short_name_table = db.execute_as_arrow(
+        db.prepare(
+            """
+            UNWIND $terms AS term
+            MATCH (s:ShortName {short_name: term})-[:SHORT_NAME_OF]->(a)
+            RETURN term, a.name AS name, a.type AS type,
+                   a.start_line AS start_line, a.end_line AS end_line;
+            """
+        ),
+        parameters={"terms": terms},
+    )
+    term_entities = {row["name"]: row for row in term_rows}
+    short_name_entities: dict[str, list[dict]] = defaultdict(list)
+    for term, entity in zip(
+        short_name_table.column("term").to_pylist(),
+        short_name_table.select(["name", "type", "start_line", "end_line"]).to_pylist(),
+    ):
+        short_name_entities[term].append(entity)
+
+    # Keep the matches ordered by term, listing each entity only once.
+    entities: dict[str, dict] = {}
+    for term in terms:
+        entity = term_entities.get(term)
+        if entity:
+            entities.setdefault(term, entity)
+        for entity in short_name_entities.get(term, ()):
+            entities.setdefault(entity["name"], entity)
 
     # Return the result as a JSON string
-    return json.dumps(
-        [
-            {
-                "name": node.name,
-                "type": node.type,
-                "start_line": node.start.line,
-                "end_line": node.end.line,
-            }
-            for node in nodes
-        ],
-        indent=2,
-    )
+    return _dumps(list(entities.values()), pretty)
 
 
 # @mcp.tool()
@@ -70,6 +109,7 @@ def traverse_graph(
     traversal_depth: int = 1,
     entity_type_filter: list[str] | None = None,
     relationship_type_filter: list[str] | None = None,
+    pretty: bool = False,
 ) -> str:
     """Analyzes and displays the relationship structure around specified entities in a code graph.
 
@@ -133,33 +173,38 @@ def traverse_graph(
         If None, all relationship types are included.
         Default is None.
 
+    pretty : bool, optional
+        Whether to indent the returned JSON.
+        Default is False.
+
     Returns:
     -------
     result : object
         An object representing the traversal results, which includes discovered entities and their dependencies.
     """
-    rtns = {
-        node: traverse_json_structure(
-            node,
-            direction,
-            traversal_depth,
-            entity_type_filter,
-            relationship_type_filter,
-        )
-        for node in start_entities
-    }
-    rtn_str = json.dumps(rtns)
-    return rtn_str.strip()
+    start_entities = list(dict.fromkeys(s.strip() for s in start_entities))
+    structures = _cached_traversals(
+        start_entities,
+        direction,
+        traversal_depth,
+        entity_type_filter,
+        relationship_type_filter,
+    )
+    rtns = {node: structures.get(node, {}) for node in start_entities}
+    return _dumps(rtns, pretty)
 
 
 @mcp.tool()
-def search_parent_or_child_entities(entity_names: list[str], direction: str) -> str:
+def search_parent_or_child_entities(
+    entity_names: list[str], direction: str, pretty: bool = False
+) -> str:
     """
     Searches for entities that are the parent classes of the given entity name.
 
     Args:
         entity_names (List[str]): List of entity names in a full-qualified format (e.g., 'src/module_a.py:ClassA').
         direction (str): The direction of the search. Can be 'parent' or 'child'.
+        pretty (bool): Whether to indent the returned JSON. Default is False.
 
     Returns:
         str: All the parent or child class entities.
@@ -171,39 +216,51 @@ def search_parent_or_child_entities(entity_names: list[str], direction: str) ->
         traversal_depth=1,
         entity_type_filter=["class", "unparsed"],
         relationship_type_filter=["inherits"],
+        pretty=pretty,
     )
 
 
 @mcp.tool()
-def search_reference_entities(entity_name: str) -> str:
+def search_reference_entities(
+    entity_name: str, max_results: int = 10_000, pretty: bool = False
+) -> str:
     """
     Searches for entities that reference (imports/inherits/references) the given entity name.
 
     Args:
         entity_name (List[str]): The entity name in a full-qualified format (e.g., 'src/module_a.py:ClassA').
+        max_results (int): The maximum number of entities to return. Default is 10000.
+        pretty (bool): Whether to indent the returned JSON. Default is False.
 
     Returns:
         str: All the matching entities.
     """
+    # Fetch only the needed properties, and stop once enough rows are found,
+    # since a widely-used entity may be referenced from a huge number of places.
     result = db.execute(
-        """
-        MATCH (a)<-[b:IMPORTS|:INHERITS|:REFERENCES]-(c)
-        WHERE a.name = $entity_name
-        RETURN c;
-        """,
-        parameters={"entity_name": entity_name},
+        db.prepare(
+            """
+            MATCH (a {name: $entity_name})
+            WITH a
+            MATCH (a)<-[b:IMPORTS|:INHERITS|:REFERENCES]-(c)
+            RETURN c.name, c.type, c.start_line, c.end_line
+            LIMIT $max_results;
+            """
+        ),
+        parameters={"entity_name": entity_name, "max_results": max(max_results, 0)},
     )
-    if not result:
-        return {}
 
     entities: list[str] = []
-    for r in result:
-        data = r[0]
-        name = f"{data['name']}"
-        if data["type"] in (NodeType.CLASS, NodeType.FUNCTION, NodeType.VARIABLE):
-            name = f"{name}#L{data['start_line']}-L{data['end_line']}"
+    for name, typ, start_line, end_line in result:
+        if typ in (NodeType.CLASS, NodeType.FUNCTION, NodeType.VARIABLE):
+            name = f"{name}#L{start_line}-L{end_line}"
         entities.append(name)
-    return json.dumps(entities, indent=2)
+    return _dumps(entities, pretty)
+
+
+def _dumps(obj, pretty: bool = False) -> str:
+    """Serialize `obj` to a JSON string, indenting it only if `pretty` is set."""
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else 0).decode()
 
 
 def traverse_json_structure(
@@ -212,52 +269,194 @@ def traverse_json_structure(
     depth: int = 1,
     entity_type_filter: list[str] | None = None,
     dependency_type_filter: list[str] | None = None,
-) -> dict:
-    result = db.execute(
-        """
-        MATCH (a)
-        WHERE a.name = $start_node
-        RETURN a.type;
-        """,
-        parameters={"start_node": start_node},
+) -> dict[str, list[str]]:
+    return traverse_json_structures(
+        [start_node],
+        direction,
+        depth,
+        entity_type_filter,
+        dependency_type_filter,
+    ).get(start_node, {})
+
+
+def traverse_json_structures(
+    start_nodes: list[str],
+    direction: str,
+    depth: int = 1,
+    entity_type_filter: list[str] | None = None,
+    dependency_type_filter: list[str] | None = None,
+) -> dict[str, dict[str, list[str]]]:
+    """Traverse from all the start nodes, reusing cached results where possible.
+
+    Start nodes that do not exist map to an empty result. The results are copies,
+    which callers are free to modify.
+    """
+    structures = _cached_traversals(
+        start_nodes,
+        direction,
+        depth,
+        entity_type_filter,
+        dependency_type_filter,
     )
-    if not result:
-        return {}
+    return {
+        start_node: {typ: list(names) for typ, names in structure.items()}
+        for start_node, structure in structures.items()
+    }
 
-    node_table = result[0][0].title()
 
-    depth = min(
-        depth if depth > 0 else 1, 5
-    )  # Limit depth to 5 for performance reasons.
-    level = f"*1..{depth}"
+def _cached_traversals(
+    start_nodes: list[str],
+    direction: str,
+    depth: int = 1,
+    entity_type_filter: list[str] | None = None,
+    dependency_type_filter: list[str] | None = None,
+) -> dict[str, dict[str, list[str]]]:
+    """Like `traverse_json_structures`, but return the cached results themselves.
 
-    rel_labels = ""
-    if dependency_type_filter:
-        rel_labels = "|".join(f":{dep.upper()}" for dep in dependency_type_filter)
-    relationship = f"-[b{rel_labels}{level}]-"
+    They are shared with the cache and must not be modified.
+    """
+    if direction not in _REL_TEMPLATE:
+        raise ValueError(f"Unsupported direction: {direction}")
+    if depth == 0:
+        return {start_node: {} for start_node in start_nodes}
+    # Unlimited depth (-1) is limited to 5 as well, for performance reasons.
+    depth = min(depth if depth > 0 else 5, 5)
+    # The label order does not matter to the query, so sort it for the cache key.
+    entity_types = tuple(sorted(entity_type_filter)) if entity_type_filter else ()
+    dependency_types = (
+        tuple(sorted(dependency_type_filter)) if dependency_type_filter else ()
+    )
 
-    match direction:
-        case "downstream":
-            relationship = f"{relationship}>"
-        case "upstream":
-            relationship = f"<{relationship}"
-        case _:  # Including "both"
-            pass
+    structures: dict[str, dict[str, list[str]]] = {}
+    missing: list[str] = []
+    for start_node in dict.fromkeys(start_nodes):
+        key = (start_node, direction, depth, entity_types, dependency_types)
+        structure = _traversal_cache.get(key)
+        if structure is None:
+            missing.append(start_node)
+        else:
+            _traversal_cache.move_to_end(key)
+            structures[start_node] = structure
 
-    target_nodes = ""
-    if entity_type_filter:
-        target_nodes = f":{':'.join(entity_type_filter).title()}"
+    for start_node, structure in _traverse(
+        missing, direction, depth, entity_types, dependency_types
+    ).items():
+        key = (start_node, direction, depth, entity_types, dependency_types)
+        _traversal_cache[key] = structures[start_node] = structure
+        if len(_traversal_cache) > TRAVERSAL_CACHE_SIZE:
+            _traversal_cache.popitem(last=False)
 
-    result = db.execute(
-        f"""
-        MATCH (a:{node_table}){relationship}(c{target_nodes})
-        WHERE a.name = $start_node
-        RETURN c.type, c.name;
-        """,
-        parameters={"start_node": start_node},
-    )
-    x = defaultdict(list)
-    for r in result:
-        x[r[0]].append(r[1])
+    return structures
+
+
+def _get_node_types(names: list[str]) -> dict[str, str]:
+    """Return the types of those of the given nodes that exist, keyed by name.
 
-    return x
+    Only the names missing from the cache are looked up, all in one query.
+    """
+    types: dict[str, str] = {}
+    missing: list[str] = []
+    for name in names:
+        typ = _node_type_cache.get(name)
+        if typ is None:
+            missing.append(name)
+        else:
+            _node_type_cache.move_to_end(name)
+            types[name] = typ
+
+    if missing:
+        result = db.execute(
+            db.prepare(
+                """
+                UNWIND $names AS name
+                MATCH (a {name: name})
+                RETURN a.name, a.type;
+                """
+            ),
+            parameters={"names": missing},
+        )
+        for name, typ in result:
+            _node_type_cache[name] = types[name] = typ
+            if len(_node_type_cache) > NODE_TYPE_CACHE_SIZE:
+                _node_type_cache.popitem(last=False)
+
+    return types
+
+
+def _traverse(
+    start_nodes: list[str],
+    direction: str,
+    depth: int,
+    entity_types: tuple[str, ...],
+    dependency_types: tuple[str, ...],
+) -> dict[str, dict[str, list[str]]]:
+    """Breadth-first traverse from all the start nodes at once.
+
+    Each hop issues one query per node table in the frontier, and every node is
+    expanded at most once per start node, instead of enumerating all paths of up
+    to `depth` hops in a single variable-length query.
+    """
+    if not start_nodes:
+        return {}
+
+    # The nodes to expand in the next hop, grouped by table: (start node, node name)
+    frontier: dict[str, list[dict]] = defaultdict(list)
+    for name, typ in _get_node_types(start_nodes).items():
+        frontier[_TYPE_TO_TABLE[typ]].append({"start": name, "node": name})
+
+    target_types = {typ.lower() for typ in entity_types}
+
+    # Nodes already expanded (or queued to be), which stops the traversal at cycles
+    expanded = {name: {name} for name in start_nodes}
+    # Nodes already reported, kept apart so that edges back to the start node count
+    reported: dict[str, set[str]] = {name: set() for name in start_nodes}
+    grouped: dict[str, dict[str, list[str]]] = {name: {} for name in start_nodes}
+    for _ in range(depth):
+        next_frontier: dict[str, list[dict]] = defaultdict(list)
+        for node_table, items in frontier.items():
+            result = db.execute(
+                db.prepare(_hop_query(node_table, direction, dependency_types)),
+                parameters={"frontier": items},
+            )
+            # Each row is already the bucket of (start node, type), without duplicates.
+            for start, typ, names in result:
+                seen = expanded[start]
+                new_names = [name for name in names if name not in seen]
+                if new_names:
+                    seen.update(new_names)
+                    next_frontier[_TYPE_TO_TABLE[typ]].extend(
+                        {"start": start, "node": name} for name in new_names
+                    )
+                if not target_types or typ in target_types:
+                    seen = reported[start]
+                    names = [name for name in names if name not in seen]
+                    if names:
+                        seen.update(names)
+                        grouped[start].setdefault(typ, []).extend(names)
+        if not next_frontier:
+            break
+        frontier = next_frontier
+
+    return grouped
+
+
+@functools.lru_cache(maxsize=256)
+def _hop_query(
+    node_table: str, direction: str, dependency_types: tuple[str, ...]
+) -> str:
+    """Build the query for one traversal hop from the nodes of `node_table`.
+
+    The text only depends on the shape of the hop, so that the same prepared
+    statement is reused for every hop and call of that shape.
+    """
+    # Always name the labels, so as not to follow the links to the short names.
+    rel_labels = "|".join(f":{dep.upper()}" for dep in dependency_types or EdgeType)
+    relationship = _REL_TEMPLATE[direction].format(labels=rel_labels)
+
+    return f"""
+        UNWIND $frontier AS f
+        MATCH (a:{node_table} {{name: f.node}})
+        WITH f, a
+        MATCH (a){relationship}(c)
+        RETURN f.start, c.type, collect(DISTINCT c.name);
+        """